@@ -1,7 +1,12 @@
+import io
 import re
+from collections import Counter
 
 import pandas as pd
 
+_NON_ALNUM = re.compile("[^0-9a-zA-Z_]+")
+_MULTI_UNDERSCORE = re.compile("_+")
+
 
 class BqPivot():
     """
@@ -25,7 +30,7 @@ class BqPivot():
                       add_col_nm_suffix=False)
     >>> print(gen.generate_query())
 
-    select Pclass, Survived, PassengenId, 
+    select Pclass, Survived, PassengenId,
     sum(case when Name = "Braund, Mr. Owen Harris" then Age else 0 end) as braund_mr_owen_harris,
     sum(case when Name = "Cumings, Mrs. John Bradley (Florence Briggs Thayer)" then Age else 0 end) as cumings_mrs_john_bradley_florence_briggs_thayer,
     sum(case when Name = "Heikkinen, Miss. Laina" then Age else 0 end) as heikkinen_miss_laina,
@@ -47,8 +52,9 @@ class BqPivot():
             data frame. The only requirement of this data is that it must have the column
             on which the pivot it to be done.
 
-        index_col: list
+        index_col: list, tuple or string
             The names of the index columns in the query (the columns on which the group by needs to be performed)
+            A single string is taken as the name of the only index column.
 
         pivot_col: string
             The name of the column on which the pivot needs to be done.
@@ -94,8 +100,9 @@ class BqPivot():
             underscore.        
         """
         self.query = ""
+        self._query_key = None
 
-        self.index_col = list(index_col)
+        self.index_col = self._get_index_col(index_col)
         self.values_col = values_col
         self.pivot_col = pivot_col
 
@@ -107,6 +114,58 @@ class BqPivot():
         
         self.function = custom_agg_fun if custom_agg_fun else agg_fun + "({})"
 
+    def _escape_piv_col_vals(self):
+        """
+        Returns the pivot values escaped for the double quoted string literals of the query.
+        """
+        return [piv_col_val.replace("\\", "\\\\").replace("\"", "\\\"")
+                           .replace("\n", "\\n").replace("\r", "\\r")
+                for piv_col_val in self.piv_col_vals]
+
+    def _create_row_fmt(self):
+        """
+        Returns a function which takes a (pivot value, pivot column name) pair and
+        returns the case statement for it.
+        """
+        # everything in a case statement except the pivot value and the pivot column name
+        # is the same for all the pivoted columns, so it is filled in once per query
+        case_query = "case when {0} = \"%s\" then {1} else {2} end".format(self.pivot_col.replace("%", "%%"),
+                                                                          self.values_col.replace("%", "%%"),
+                                                                          str(self.not_eq_default).replace("%", "%%"))
+        case_query = self.function.replace("%", "%%").format(case_query) + " as %s"
+        return case_query.__mod__
+
+    def _get_query_key(self):
+        """
+        Returns everything the query depends on, which is used to check whether the
+        cached query is still valid after the attributes have been changed.
+        """
+        return (self._get_index_col(self.index_col), self.pivot_col, self.values_col, self.not_eq_default,
+                self.function, self.table_name, tuple(self.piv_col_vals), tuple(self.piv_col_names))
+
+    def _get_cached_query(self):
+        """
+        Returns the cached query if none of the attributes it depends on have changed,
+        otherwise an empty string.
+        """
+        if self.query and self._get_query_key() == self._query_key:
+            return self.query
+        return ""
+
+    def _check_piv_cols(self):
+        """
+        Makes sure that every pivot column value has a pivot column name.
+        """
+        if len(self.piv_col_vals) != len(self.piv_col_names):
+            raise ValueError("piv_col_vals and piv_col_names must have the same number of values. "\
+                             "Make sure that both are updated when changing the pivot column values.")
+
+    def _get_index_col(self, index_col):
+        """
+        Returns the index columns as a tuple, a single column name can be given as a string.
+        """
+        return (index_col,) if isinstance(index_col, str) else tuple(index_col)
+
     def _get_table_name(self, table_name):
         """
         Returns the table name or a placeholder if the table name is not provided.
@@ -118,46 +177,63 @@ class BqPivot():
         Gets all the unique values of the pivot column.
         """
         if isinstance(data, pd.DataFrame):
-            self.data = data
+            columns = data.columns
         elif isinstance(data, str):
-            self.data = pd.read_csv(data)
+            # read only the header so that a missing column is reported before parsing the file
+            columns = pd.read_csv(data, nrows=0).columns
         else:
             raise ValueError("Provided data must be a pandas dataframe or a csv file path.")
 
-        if self.pivot_col not in self.data.columns:
+        if self.pivot_col not in columns:
             raise ValueError("The provided data must have the column on which pivot is to be done. "\
                              "Also make sure that the column name in the data is same as the name "\
                              "provided to the pivot_col parameter.")
 
-        return self.data[self.pivot_col].astype(str).unique().tolist()
+        if isinstance(data, str):
+            # only the pivot column is needed
+            df = pd.read_csv(data, usecols=[self.pivot_col])
+        else:
+            df = data
+
+        # find the unique values first so that only those need to be converted to strings,
+        # for a categorical column this works on the integer codes instead of the values.
+        # Different values can have the same string (like 1 and "1"), so these are
+        # deduplicated once more while keeping the order.
+        return list(dict.fromkeys(str(piv_col_val) for piv_col_val in df[self.pivot_col].unique()))
     
-    def _clean_col_name(self, col_name):
+    def _create_piv_col_names(self, add_col_nm_suffix, prefix, suffix):
         """
-        The pivot column values can have arbitrary strings but in order to 
-        convert them to column names some cleaning is required. This method 
-        takes a string as input and returns a clean column name.
+        The method created a list of pivot column names of the new pivoted table.
         """
-        
+        prefix = prefix + "_" if prefix else ""
+        suffix = "_" + suffix if suffix else ""
+
+        # The pivot column values can have arbitrary strings but in order to
+        # convert them to column names some cleaning is required, done on all
+        # the values at once:
         # replace spaces with underscores
         # remove non alpha numeric characters other than underscores
         # replace multiple consecutive underscores with one underscore
         # make all characters lower case
         # remove trailing underscores
-        return re.sub("_+", "_", re.sub('[^0-9a-zA-Z_]+', '', re.sub(" ", "_", col_name))).lower().rstrip("_")
-
-    def _create_piv_col_names(self, add_col_nm_suffix, prefix, suffix):
-        """
-        The method created a list of pivot column names of the new pivoted table.
-        """
-        prefix = prefix + "_" if prefix else ""
-        suffix = "_" + suffix if suffix else ""
+        clean_col_names = pd.Series(self.piv_col_vals, dtype="string")\
+                            .str.replace(" ", "_", regex=False)\
+                            .str.replace(_NON_ALNUM, "", regex=True)\
+                            .str.replace(_MULTI_UNDERSCORE, "_", regex=True)\
+                            .str.lower()\
+                            .str.rstrip("_")
 
         if add_col_nm_suffix:
-            piv_col_names = ["{0}{1}_{2}{3}".format(prefix, self._clean_col_name(piv_col_val), self.values_col.lower(), suffix)
-                             for piv_col_val in self.piv_col_vals]
-        else:
-            piv_col_names = ["{0}{1}{2}".format(prefix, self._clean_col_name(piv_col_val), suffix)
-                             for piv_col_val in self.piv_col_vals]
+            suffix = "_" + self.values_col.lower() + suffix
+
+        piv_col_names = [prefix + clean_col_name + suffix for clean_col_name in clean_col_names.tolist()]
+
+        # different pivot values can be cleaned to the same column name, which BigQuery rejects
+        duplicates = [piv_col_name for piv_col_name, count in Counter(piv_col_names).items() if count > 1]
+        if duplicates:
+            raise ValueError("Some of the pivot column values result in the same column name after "\
+                             "cleaning: {0}. Make sure that the values of the pivot column differ "\
+                             "in more than case and non alpha numeric characters.".format(", ".join(duplicates)))
 
         return piv_col_names
 
@@ -165,51 +241,73 @@ class BqPivot():
         """
         Adds the select statement part of the query.
         """
-        query = "select " + "".join([index_col + ", " for index_col in self.index_col]) + "\n"
+        query = "select " + ", ".join(self._get_index_col(self.index_col)) + ",\n"
         return query
 
-    def _add_case_statement(self):
+    def _iter_case_statement(self):
         """
-        Adds the case statement part of the query.
+        Yields the case statement part of the query, one pivoted column at a time.
         """
-        case_query = self.function.format("case when {0} = \"{1}\" then {2} else {3} end") + " as {4},\n"
+        row_fmt = self._create_row_fmt()
 
-        query = "".join([case_query.format(self.pivot_col, piv_col_val, self.values_col,
-                                           self.not_eq_default, piv_col_name)
-                         for piv_col_val, piv_col_name in zip(self.piv_col_vals, self.piv_col_names)])
-        
-        query = query[:-2] + "\n"
-        return query
+        separator = ""
+        for case_statement in map(row_fmt, zip(self._escape_piv_col_vals(), self.piv_col_names)):
+            yield separator
+            yield case_statement
+            separator = ",\n"
+
+        yield "\n"
 
     def _add_from_statement(self):
         """
         Adds the from statement part of the query.
         """
-        query =  "from {0}\n".format(self.table_name)
+        query =  "from {0}\n".format(self._get_table_name(self.table_name))
         return query
 
     def _add_group_by_statement(self):
         """
         Adds the group by part of the query.
         """
-        query = "group by " + "".join(["{0},".format(x) for x in range(1, len(self.index_col) + 1)])
-        return query[:-1]
+        query = "group by " + ",".join(map(str, range(1, len(self._get_index_col(self.index_col)) + 1)))
+        return query
 
     def generate_query(self):
         """
         Returns the query to create the pivoted table.
         """
-        self.query = self._add_select_statement() +\
-                     self._add_case_statement() +\
-                     self._add_from_statement() +\
-                     self._add_group_by_statement()
+        if self._get_cached_query():
+            return self.query
+
+        self._check_piv_cols()
+
+        query = io.StringIO()
+        query.writelines(self._iter_query_fragments())
+        self.query = query.getvalue()
+        self._query_key = self._get_query_key()
 
         return self.query
 
+    def _iter_query_fragments(self):
+        """
+        Yields the parts of the query in order, so that a large query can be written
+        out without first building it as a single string.
+        """
+        yield self._add_select_statement()
+        yield from self._iter_case_statement()
+        yield self._add_from_statement()
+        yield self._add_group_by_statement()
+
     def write_query(self, output_file):
         """
         Writes the query to a text file.
         """
-        text_file = open(output_file, "w")
-        text_file.write(self.generate_query())
-        text_file.close()
+        query = self._get_cached_query()
+        if not query:
+            self._check_piv_cols()
+
+        with open(output_file, "w", buffering=1 << 20) as text_file:
+            if query:
+                text_file.write(query)
+            else:
+                text_file.writelines(self._iter_query_fragments())
@@ -0,0 +1,130 @@
+import pandas as pd
+import pytest
+
+from bq_pivot import BqPivot
+
+
+def test_csv_path_matches_dataframe(tmp_path):
+    csv_path = tmp_path / "data.csv"
+    csv_path.write_text("k,p,v\na,1,3\nb,01,4\nc,2.50,5\nd,,6\n")
+
+    from_csv = BqPivot(str(csv_path), index_col=["k"], pivot_col="p", values_col="v")
+    from_df = BqPivot(pd.read_csv(csv_path), index_col=["k"], pivot_col="p", values_col="v")
+
+    assert from_csv.piv_col_vals == ["1.0", "2.5", "nan"]
+    assert from_csv.piv_col_names == ["10_v", "25_v", "nan_v"]
+    assert from_csv.generate_query() == from_df.generate_query()
+
+
+def test_csv_pivot_values_do_not_depend_on_installed_parsers(tmp_path):
+    csv_path = tmp_path / "data.csv"
+    csv_path.write_text("k,p,v\na,2024-01-01 10:00,3\nb,,4\n")
+
+    gen = BqPivot(str(csv_path), index_col=["k"], pivot_col="p", values_col="v")
+
+    assert gen.piv_col_vals == ["2024-01-01 10:00", "nan"]
+
+
+def _titanic_pivot(**kwargs):
+    data = pd.DataFrame({"Pclass": [1, 2, 3], "Name": ["A b", "C", "A b"], "Age": [20, 30, 40]})
+    return BqPivot(data=data, index_col=["Pclass"], pivot_col="Name", values_col="Age", **kwargs)
+
+
+def test_generate_query():
+    gen = _titanic_pivot(table_name="titanic")
+
+    assert gen.generate_query() == ("select Pclass,\n"
+                                    "sum(case when Name = \"A b\" then Age else 0 end) as a_b_age,\n"
+                                    "sum(case when Name = \"C\" then Age else 0 end) as c_age\n"
+                                    "from titanic\n"
+                                    "group by 1")
+
+
+def test_reassigned_attributes_are_used():
+    gen = _titanic_pivot()
+    query = gen.generate_query()
+
+    gen.table_name = "titanic"
+    gen.not_eq_default = "null"
+    assert gen.generate_query() == query.replace("<--insert-table-name-here-->", "titanic")\
+                                        .replace("else 0", "else null")
+
+    gen.table_name = "titanic2"
+    assert "from titanic2\n" in gen.generate_query()
+
+
+def test_reassigned_index_col_and_table_name_are_normalized():
+    gen = _titanic_pivot(table_name="titanic")
+    gen.generate_query()
+
+    gen.index_col = "Pclass"
+    gen.table_name = None
+
+    assert gen.generate_query().startswith("select Pclass,\n")
+    assert gen.generate_query().endswith("from <--insert-table-name-here-->\ngroup by 1")
+
+
+def test_reassigned_pivot_values_need_matching_names(tmp_path):
+    gen = _titanic_pivot()
+    gen.generate_query()
+
+    gen.piv_col_vals = ["z"]
+    with pytest.raises(ValueError):
+        gen.generate_query()
+    with pytest.raises(ValueError):
+        gen.write_query(str(tmp_path / "query.sql"))
+
+    gen.piv_col_names = ["z_age"]
+    assert "sum(case when Name = \"z\" then Age else 0 end) as z_age\n" in gen.generate_query()
+
+
+def test_write_query_matches_generate_query(tmp_path):
+    gen = _titanic_pivot()
+    output_file = tmp_path / "query.sql"
+
+    gen.write_query(str(output_file))
+    assert output_file.read_text() == gen.generate_query()
+
+    gen.table_name = "titanic"
+    gen.write_query(str(output_file))
+    assert output_file.read_text() == gen.generate_query()
+    assert "from titanic\n" in output_file.read_text()
+
+
+def test_datetime_pivot_values_keep_their_text():
+    data = pd.DataFrame({"k": [1, 2, 3],
+                         "p": pd.to_datetime(["2024-01-01 10:00", "2024-01-02 10:00", "2024-01-01 10:00"]),
+                         "v": [1, 2, 3]})
+
+    gen = BqPivot(data=data, index_col=["k"], pivot_col="p", values_col="v")
+
+    assert gen.piv_col_vals == ["2024-01-01 10:00:00", "2024-01-02 10:00:00"]
+    assert gen.piv_col_names == ["20240101_100000_v", "20240102_100000_v"]
+
+
+def test_pivot_values_cleaned_to_the_same_name_raise():
+    data = pd.DataFrame({"k": [1, 2], "p": ["A b", "a b!"], "v": [1, 2]})
+
+    with pytest.raises(ValueError, match="a_b_v"):
+        BqPivot(data=data, index_col=["k"], pivot_col="p", values_col="v")
+
+
+def test_attributes_set_before_generate_query_are_used():
+    gen = _titanic_pivot()
+
+    gen.pivot_col = "Title"
+    gen.values_col = "Fare"
+    gen.not_eq_default = "null"
+    gen.function = "max({})"
+
+    assert "max(case when Title = \"C\" then Fare else null end) as c_age\n" in gen.generate_query()
+
+
+def test_pivot_values_are_escaped_in_the_query():
+    data = pd.DataFrame({"k": [1, 2, 3], "p": ["say \"hi\"", "a\\b", "two\nlines\r"], "v": [1, 2, 3]})
+
+    query = BqPivot(data=data, index_col=["k"], pivot_col="p", values_col="v").generate_query()
+
+    assert "case when p = \"say \\\"hi\\\"\" then v" in query
+    assert "case when p = \"a\\\\b\" then v" in query
+    assert "case when p = \"two\\nlines\\r\" then v" in query